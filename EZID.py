@@ -6,12 +6,6 @@ Can use this as a client command line program or pull the EZIDClient object
 into other programs
 Following the samples from: https://ezid.cdlib.org/doc/apidoc.html
 '''
-from __future__ import print_function
-
-from future import standard_library
-standard_library.install_aliases()
-from builtins import range
-from builtins import object
 __author__ = "Mark Redar"
 __copyright__ = "Copyright 2011, The Regents of the University of California"
 __credits__ = ["Greg Janee", ]
@@ -21,27 +15,69 @@ __maintainer__ = "Mark Redar"
 __email__ = "mark.redar@ucop.edu"
 __status__ = "Prototype"
 
-import re
+import asyncio
+import functools
+import http.cookiejar
+import importlib.util
+import json
+import os
+import random
 import sys
-import types
-import urllib.request, urllib.error, urllib.parse
+import time
+import urllib.parse
+import urllib.request
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-__all__=('EZIDClient', 'formatAnvlFromDict', 'formatAnvlFromList')
+__all__=('EZIDClient', 'AsyncEZIDClient', 'formatAnvlFromDict',
+         'formatAnvlFromDictBytes', 'formatAnvlFromList')
 
 SERVER = "https://ezid.cdlib.org"
+TIMEOUT = 30 # seconds
+# transient failures are retried with exponential backoff
+RETRIES = 5
+RETRY_BACKOFF = 0.5 # seconds, doubled on each attempt
+RETRY_BACKOFF_MAX = 120 # seconds, longest wait, as urllib3's default backoff_max
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# POST (mint, update) is not idempotent and EZID may already have acted on it
+# before a 5xx or a dropped connection, so POST is only retried when it
+# provably wasn't processed: connect errors and these refusals
+POST_RETRY_STATUS = (429, 503)
+SESSION_CACHE = os.path.join("~", ".ezid", "session.json")
+VIEW_CACHE_TTL = 300 # seconds a cached view is served without asking EZID
+VIEW_CACHE_SIZE = 1024 # identifiers kept in the view cache
 
 operations = {
-    # operation : number of arguments
+    # operation : check on number of arguments
     "mint" : lambda l: l%2 == 1,
     "create" : lambda l: l%2 == 1,
-    "view" : 1,
+    "view" : lambda l: l == 1,
     "update" : lambda l: l%2 == 1,
     "delete" : lambda l: l%2 == 1,
-    "login" : 0,
-    "logout" : 0
+    "login" : lambda l: l == 0,
+    "logout" : lambda l: l == 0
 }
 
+def _build_prefix_map(names):
+    '''Map every prefix of the operation names to its operation,
+    or to None if the prefix is ambiguous.
+
+    >>> m = _build_prefix_map(['login', 'logout', 'mint'])
+    >>> m['m'], m['logi'], m['lo'], m['logout']
+    ('mint', 'login', None, 'logout')
+    '''
+    prefix_map = {}
+    for name in names:
+        for i in range(1, len(name) + 1):
+            prefix = name[:i]
+            prefix_map[prefix] = None if prefix in prefix_map else name
+    for name in names:
+        prefix_map[name] = name
+    return prefix_map
+
+_PREFIX_MAP = _build_prefix_map(operations)
+
 _usageText = """Usage: client credentials operation...
 
     credentials
@@ -59,6 +95,18 @@ _usageText = """Usage: client credentials operation...
         logout
 """
 
+# ANVL percent-escapes; labels also escape the ":" separator
+_LABEL_TABLE = str.maketrans({'%': '%25', ':': '%3A', '\r': '%0D', '\n': '%0A'})
+_VALUE_TABLE = str.maketrans({'%': '%25', '\r': '%0D', '\n': '%0A'})
+
+def _quote_id(identifier):
+    '''Percent-encode an identifier or shoulder for use in a URL path
+
+    >>> _quote_id('ark:/99999/fk4 x#1')
+    'ark:/99999/fk4%20x%231'
+    '''
+    return urllib.parse.quote(identifier, safe='/:.')
+
 def _usageError ():
     sys.stderr.write(_usageText)
     sys.exit(1)
@@ -68,40 +116,144 @@ def formatAnvlFromDict(d):
     Values should be simple data types
 
     >>> formatAnvlFromDict({'dc.title':'test title', 'dc.creator':'mer',})
-    'dc.creator: mer\\ndc.title: test title'
+    'dc.title: test title\\ndc.creator: mer'
+    >>> formatAnvlFromDict({'a:b':'100%\\r\\n'})
+    'a%3Ab: 100%25%0D%0A'
     '''
-    r = []
-    for k, v in list(d.items()):
-        label = re.sub("[%:\r\n]", lambda c: "%%%02X" % ord(c.group(0)), k)
-        value = re.sub("[%\r\n]", lambda c: "%%%02X" % ord(c.group(0)), v)
-        r.append("%s: %s" % (label, value))
-    return "\n".join(r)
+    return "\n".join("%s: %s" % (k.translate(_LABEL_TABLE), v.translate(_VALUE_TABLE))
+                     for k, v in d.items())
+
+def formatAnvlFromDictBytes(d):
+    '''Same as formatAnvlFromDict, but return the UTF-8 encoded request
+    body directly, without first building the whole text as a str.
+
+    >>> formatAnvlFromDictBytes({'dc.title':'caf\\xe9', 'a:b':'100%'})
+    b'dc.title: caf\\xc3\\xa9\\na%3Ab: 100%25'
+    '''
+    return b"\n".join(b"%s: %s" % (k.translate(_LABEL_TABLE).encode("UTF-8"),
+                                   v.translate(_VALUE_TABLE).encode("UTF-8"))
+                      for k, v in d.items())
 
 def formatAnvlFromList (l):
     '''Produce anvl formatted text from a list of name-value pairs.
     Values should be simple data types.
     >>> formatAnvlFromList( ['dc.title', 'test title', 'dc.creator', 'mer'])
     'dc.title: test title\\ndc.creator: mer'
+    >>> formatAnvlFromList(['dc.title', 'test title', 'dc.creator'])
+    Traceback (most recent call last):
+        ...
+    ValueError: unpaired label: 'dc.creator'
+    '''
+    if len(l) % 2:
+        raise ValueError("unpaired label: %r" % (l[-1],))
+    it = iter(l)
+    return "\n".join("%s: %s" % (k.translate(_LABEL_TABLE), v.translate(_VALUE_TABLE))
+                     for k, v in zip(it, it))
+
+
+class _Retry(Retry):
+    '''urllib3 Retry that repeats a POST only on POST_RETRY_STATUS.
+    POST is left out of allowed_methods, so read errors on it aren't retried
+    '''
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if method == "POST":
+            return status_code in POST_RETRY_STATUS
+        return super().is_retry(method, status_code, has_retry_after)
+
+
+@functools.lru_cache(maxsize=None)
+def _https_adapter():
+    '''Keep-alive connection pool shared by every EZIDClient, so creating
+    a client per call still reuses open connections.
+    Auth, cookies and proxies stay on each client's own Session.
+    '''
+    return HTTPAdapter(pool_connections=1, pool_maxsize=32,
+        max_retries=_Retry(total=RETRIES, backoff_factor=RETRY_BACKOFF,
+            status_forcelist=RETRY_STATUS, respect_retry_after_header=True,
+            allowed_methods=frozenset(("GET", "PUT", "DELETE")),
+            raise_on_status=False))
+
+
+class _SessionCache(object):
+    '''Session id saved to disk between processes, so a login can be
+    reused by later command line calls until it expires.
+    Only one session is kept; it is ignored for other servers or users.
+
+    >>> import tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), 'session.json')
+    >>> cache = _SessionCache('https://ezid.cdlib.org', 'user', path)
+    >>> cache.load()
+    (None, 0)
+    >>> cache.save('abc')
+    >>> sid, expires_at = cache.load()
+    >>> sid, expires_at > time.time()
+    ('abc', True)
+    >>> oct(os.stat(path).st_mode & 0o777)
+    '0o600'
+    >>> _SessionCache('https://ezid.cdlib.org', 'other', path).load()
+    (None, 0)
+    >>> cache.save('abc', ttl=-1)
+    >>> cache.load()[1] < time.time()
+    True
+    >>> cache.clear()
+    >>> cache.load()
+    (None, 0)
+    >>> unwritable = _SessionCache('https://ezid.cdlib.org', 'user',
+    ...                            os.path.join(path, 'not-a-dir', 'session.json'))
+    >>> cache.save('abc')
+    >>> unwritable.save('abc')
+    >>> unwritable.load()
+    (None, 0)
     '''
+    __slots__ = ('_path', '_owner')
+
+    def __init__(self, server, username, path=SESSION_CACHE):
+        self._path = os.path.expanduser(path)
+        self._owner = [server, username]
 
-    r = []
-    for i in range(0, len(l), 2):
-        k = re.sub("[%:\r\n]", lambda c: "%%%02X" % ord(c.group(0)), l[i])
-        v = re.sub("[%\r\n]", lambda c: "%%%02X" % ord(c.group(0)), l[i+1])
-        r.append("%s: %s" % (k, v))
-    return "\n".join(r)
+    def load(self):
+        '''Return (session id, expiry time), or (None, 0) if none saved
+        '''
+        try:
+            with open(self._path) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None, 0
+        if entry.get('owner') != self._owner:
+            return None, 0
+        return entry.get('sessionid'), entry.get('expires_at', 0)
+
+    def save(self, sid, ttl=3600):
+        '''Best effort: an unwritable home just means no caching
+        '''
+        try:
+            os.makedirs(os.path.dirname(self._path), mode=0o700, exist_ok=True)
+            fd = os.open(self._path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'owner': self._owner, 'sessionid': sid,
+                           'expires_at': time.time() + ttl}, f)
+        except OSError:
+            pass
+
+    def clear(self):
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
 
 
 class EZIDClient(object):
     '''Class for conducting EZID transactions
     Use http if has session_id, else need credentials for most operations
+    With cache='memory', view() results are kept for VIEW_CACHE_TTL seconds
+    and then revalidated with If-None-Match.
 
 
     >>> ez=EZIDClient()
     >>> info = ez.view('ark:/13030/c88s')
     Traceback (most recent call last):
         ...
-    HTTPError: HTTP Error 400: BAD REQUEST
+    HTTPError: 400 Client Error: BAD REQUEST for url: https://ezid.cdlib.org/id/ark:/13030/c88s
     >>> info = ez.view('ark:/13030/c88s4n09')
     >>> for x in info.split(b'\\n'):
     ...     print(x)
@@ -128,24 +280,39 @@ class EZIDClient(object):
         ...
     HTTPError: 401 Client Error: UNAUTHORIZED for url: https://ezid.cdlib.org/login
     '''
-    def __init__(self, server=SERVER, proxy=None, credentials=None, session_id=None):
+    __slots__ = ('_proxy', '_session', '_server', '_id_url', '_shoulder_url',
+                 '_login_url', '_logout_url', '_credentials', '_session_cache',
+                 '_session_id', '_view_cache')
+    CACHES = ("none", "memory")
+
+    def __init__(self, server=SERVER, proxy=None, credentials=None, session_id=None,
+                 session_cache=False, cache="none"):
+        if cache not in self.CACHES:
+            raise ValueError("cache must be one of %s" % (self.CACHES,))
+        # url -> (etag, view text, expiry time)
+        self._view_cache = {} if cache == "memory" else None
         self._proxy = proxy # dict of http, https proxies
-        proxy_handler = None
-        if self._proxy:
-            proxy_handler = urllib.request.ProxyHandler(self._proxy)
-            self._opener = urllib.request.build_opener(proxy_handler)
-        else:
-            self._opener = urllib.request.build_opener()
+        self._session = requests.Session()
+        self._session.mount("https://", _https_adapter())
         self._server = server
+        self._id_url = server.rstrip('/') + "/id/"
+        self._shoulder_url = server.rstrip('/') + "/shoulder/"
+        self._login_url = server.rstrip('/') + "/login"
+        self._logout_url = server.rstrip('/') + "/logout"
         self._credentials = credentials # dict of username, password
-        self._session_id = session_id
-        self._cookie = None
-        if self._session_id:
-            self._cookie = "sessionid=" + session_id
         if self._credentials:
-            h = urllib.request.HTTPBasicAuthHandler()
-            h.add_password("EZID", self._server, self._credentials['username'], self._credentials['password'])
-            self._opener.add_handler(h)
+            self._session.auth = (self._credentials.get('username', ''),
+                                  self._credentials.get('password', ''))
+        self._session_cache = None
+        if session_cache and self._credentials:
+            self._session_cache = _SessionCache(server,
+                                                self._credentials.get('username', ''))
+            if not session_id:
+                sid, expires_at = self._session_cache.load()
+                if sid and expires_at > time.time():
+                    session_id = sid
+        self._session_id = None
+        self.session_id = session_id
 
     @property
     def session_id(self):
@@ -154,89 +321,365 @@ class EZIDClient(object):
     @session_id.setter
     def session_id(self, sid):
         self._session_id = sid
+        # pop() raises CookieConflictError once the jar holds two sessionids
+        requests.cookies.remove_cookie_by_name(self._session.cookies, "sessionid")
         if self._session_id:
-            self._cookie = "sessionid=" + self._session_id
-
-    def _get_request(self, request, login=False):
-        if self._cookie: request.add_header("Cookie", self._cookie)
-        try:
-            c = self._opener.open(request)
-        except urllib.error.HTTPError as e:
-            print(e.read())
-            raise
-        output = c.read()
-        #if not output.endswith(b"\n"): output += "\n"
-        if login:
-            output = c.info()["set-cookie"].split(";")[0].split("=")[1]
-        return output.decode("utf-8")
+            # filed under the domain cookielib uses for the server's own cookie
+            # ("<host>.local" for dotless hosts), so one replaces the other
+            domain = http.cookiejar.eff_request_host(
+                urllib.request.Request(self._server))[1]
+            self._session.cookies.set("sessionid", self._session_id,
+                                      domain=domain, path="/")
+
+    def _request(self, method, url, data=None, login=False, headers=None):
+        '''Send the request and return the response with its body
+        still unread, for the caller to stream and close.
+        '''
+        headers = dict(headers or ())
+        if data is not None:
+            headers["Content-Type"] = "text/plain; charset=UTF-8"
+        resp = self._session.request(method, url, data=data, headers=headers,
+                                     proxies=self._proxy, timeout=TIMEOUT,
+                                     stream=True)
+        if resp.status_code == 401 and not login and self._session_cache:
+            # cached session expired on the server, log in again and retry once
+            resp.close()
+            self._session_cache.clear()
+            self.login()
+            resp = self._session.request(method, url, data=data, headers=headers,
+                                         proxies=self._proxy, timeout=TIMEOUT,
+                                         stream=True)
+        if not resp.ok:
+            print(resp.text)
+            resp.close()
+        resp.raise_for_status()
+        return resp
+
+    @staticmethod
+    def _text(resp):
+        resp.encoding = "utf-8"
+        return resp.text
+
+    @staticmethod
+    def _first_line(resp):
+        '''First line of the body, reading no further than needed.
+        Split on "\\n" only, since values may hold other line breaks
+        '''
+        resp.encoding = "utf-8"
+        return next(resp.iter_lines(decode_unicode=True, delimiter="\n"), '')
+
+    def _get_request(self, method, url, data=None, login=False):
+        with self._request(method, url, data=data, login=login) as resp:
+            # read the body even for login, so the connection goes back to the pool
+            output = self._text(resp)
+            if login:
+                return resp.cookies.get("sessionid")
+            return output
+
+    def _id_of(self, identifier):
+        return self._id_url + _quote_id(identifier)
+
+    def _forget(self, identifier):
+        '''Drop a cached view after the id is changed
+        '''
+        if self._view_cache is not None:
+            self._view_cache.pop(self._id_of(identifier), None)
 
     def view(self, identifier):
         '''View an id. If id is public, no login or session id required
         for public ids.
         '''
-        url = "%s/id/%s" % (self._server, identifier)
-        request = urllib.request.Request(url)
-        return self._get_request(request)
+        url = self._id_of(identifier)
+        if self._view_cache is None:
+            return self._get_request("GET", url)
+        etag, output, expires_at = self._view_cache.get(url, (None, None, 0))
+        if expires_at <= time.time():
+            # a failed revalidation raises here and leaves the entry in place
+            headers = {"If-None-Match": etag} if etag else None
+            with self._request("GET", url, headers=headers) as resp:
+                if resp.status_code != 304:
+                    output = self._text(resp)
+                etag = resp.headers.get("ETag", etag)
+            expires_at = time.time() + VIEW_CACHE_TTL
+        # re-insert at the end, so the least recently viewed id is evicted first
+        self._view_cache.pop(url, None)
+        if len(self._view_cache) >= VIEW_CACHE_SIZE:
+            del self._view_cache[next(iter(self._view_cache))]
+        self._view_cache[url] = (etag, output, expires_at)
+        return output
 
     def login(self):
         '''Login, caching session id
         '''
-        url = "%s/%s" % (self._server, 'login')
-        auth = None
-        if self._credentials:
-            username = self._credentials.get('username', '')
-            password = self._credentials.get('password', '')
-            auth = (username, password)
-        res = requests.get(url, auth=auth)
-        res.raise_for_status()
-        self.session_id = res.headers.get('Set-Cookie').split(";")[0].split("=")[1]
+        self.session_id = self._get_request("GET", self._login_url, login=True)
+        if self._session_cache:
+            self._session_cache.save(self.session_id)
         return self.session_id
 
     def logout(self):
-        '''logout, caching session id
+        '''logout, dropping the cached session id
         '''
-        request = urllib.request.Request("%s/%s" % (self._server, 'logout'))
-        self.session_id = self._get_request(request)
-        return self.session_id
+        output = self._get_request("GET", self._logout_url)
+        if self._session_cache:
+            self._session_cache.clear()
+        self.session_id = None
+        return output
 
     def update(self, identifier, data):
         if not self.session_id:
             self.session_id = self.login()
-        request = urllib.request.Request("%s/id/%s" % (self._server, identifier))
-        request.get_method = lambda: "POST"
-        request.add_header("Content-Type", "text/plain; charset=UTF-8")
-        request.data = formatAnvlFromDict(data).encode("UTF-8")
-        return self._get_request(request)
+        self._forget(identifier)
+        return self._get_request("POST", self._id_of(identifier),
+                                 data=formatAnvlFromDictBytes(data))
 
     def create(self, identifier, data=None):
         if not self.session_id:
             self.session_id = self.login()
-        request = urllib.request.Request("%s/id/%s" % (self._server, identifier))
-        request.get_method = lambda: "PUT"
-        if data:
-            request.add_header("Content-Type", "text/plain; charset=UTF-8")
-            request.data = formatAnvlFromDict(data).encode("UTF-8")
-        return self._get_request(request)
+        self._forget(identifier)
+        body = formatAnvlFromDictBytes(data) if data else None
+        return self._get_request("PUT", self._id_of(identifier),
+                                 data=body)
 
     def mint(self, shoulder, data=None):
         '''Mint a new identifier on EZID. Return the identifier if successful
+        Only retried if EZID refused it (see POST_RETRY_STATUS), never after
+        an error that may have left a minted identifier behind.
+        '''
+        if not self.session_id:
+            self.session_id = self.login()
+        body = formatAnvlFromDictBytes(data) if data else None
+        with self._request("POST", self._shoulder_url + _quote_id(shoulder),
+                           data=body) as resp:
+            # the identifier is on the first line, don't read past it
+            first = self._first_line(resp)
+        return first.replace('success: ','').strip()
+
+    def mint_batch(self, shoulder, records, concurrency=32):
+        '''Mint one identifier per entry of records (a metadata dict or
+        None), running up to concurrency requests at once through an
+        AsyncEZIDClient. Returns a list in the same order as records; an
+        entry that failed holds the exception instead of the identifier,
+        so one bad record does not lose the rest of the batch.
+
+        Needs the 'async' (aiohttp) or 'http2' (httpx) extra installed.
+        It starts its own event loop, so it can't be called from code
+        already running in one (Jupyter, async web apps); await
+        AsyncEZIDClient.mint_many there instead.
         '''
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError("mint_batch can't run inside an event loop, "
+                               "await AsyncEZIDClient.mint_many instead")
+        if (_default_transport() == "aiohttp" and
+                not importlib.util.find_spec("aiohttp")):
+            raise ImportError("mint_batch needs aiohttp or httpx, "
+                              "install EZID[async] or EZID[http2]")
         if not self.session_id:
             self.session_id = self.login()
-        request = urllib.request.Request("%s/shoulder/%s" % (self._server, shoulder))
-        request.get_method = lambda: "POST"
-        if data:
-            request.add_header("Content-Type", "text/plain; charset=UTF-8")
-            request.data = formatAnvlFromDict(data).encode("UTF-8")
-        return self._get_request(request).replace('success: ','').strip()
+        async def _mint_all():
+            async with AsyncEZIDClient(self._server, proxy=self._proxy,
+                                       credentials=self._credentials,
+                                       session_id=self.session_id) as ez:
+                return await ez.mint_many(shoulder, records, concurrency)
+        return asyncio.run(_mint_all())
 
     def delete(self, identifier):
         if not self.session_id:
             self.session_id = self.login()
-        request = urllib.request.Request("%s/id/%s" % (self._server, identifier))
-        request.get_method = lambda: "DELETE"
-        request.add_header("Content-Type", "text/plain; charset=UTF-8")
-        return self._get_request(request)
+        self._forget(identifier)
+        return self._get_request("DELETE", self._id_of(identifier))
+
+
+def _default_transport():
+    '''HTTP/2 over httpx when httpx and h2 are installed, else aiohttp
+    '''
+    if importlib.util.find_spec("httpx") and importlib.util.find_spec("h2"):
+        return "httpx-h2"
+    return "aiohttp"
+
+
+class AsyncEZIDClient(object):
+    '''asyncio counterpart of EZIDClient.
+    Use as an async context manager so the connection pool is shared by
+    every call made inside the block, e.g.
+
+        async with AsyncEZIDClient(credentials=creds) as ez:
+            infos = await asyncio.gather(*[ez.view(i) for i in ids])
+
+    transport is 'httpx-h2' (HTTP/2, many requests multiplexed over one
+    connection) or 'aiohttp' (HTTP/1.1 connection pool). The default
+    is httpx-h2 when it is installed.
+    '''
+    TRANSPORTS = ("httpx-h2", "aiohttp")
+    __slots__ = ('_proxy', '_server', '_credentials', '_session_id', '_transport',
+                 '_session')
+
+    def __init__(self, server=SERVER, proxy=None, credentials=None, session_id=None,
+                 transport=None):
+        self._proxy = proxy # dict of http, https proxies
+        self._server = server.rstrip('/')
+        self._credentials = credentials # dict of username, password
+        self._session_id = session_id
+        self._transport = transport or _default_transport()
+        if self._transport not in self.TRANSPORTS:
+            raise ValueError("transport must be one of %s" % (self.TRANSPORTS,))
+        self._session = None
+
+    @property
+    def session_id(self):
+        return self._session_id
+
+    async def __aenter__(self):
+        auth = None
+        if self._credentials:
+            auth = (self._credentials.get('username', ''),
+                    self._credentials.get('password', ''))
+        # the session id is sent as an explicit Cookie header by _send, not
+        # kept in a cookie jar where the server's own sessionid would join it
+        proxy = self._proxy.get('https') if self._proxy else None
+        if self._transport == "httpx-h2":
+            import httpx
+            # proxy= needs httpx>=0.26, so only pass it when there is one
+            kwargs = {'proxy': proxy} if proxy else {}
+            self._session = httpx.AsyncClient(base_url=self._server, http2=True,
+                timeout=TIMEOUT, auth=auth,
+                cookies=http.cookiejar.CookieJar(
+                    http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+                limits=httpx.Limits(max_connections=100,
+                                    max_keepalive_connections=20), **kwargs)
+        else:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=64, ssl=True),
+                timeout=aiohttp.ClientTimeout(total=TIMEOUT),
+                auth=aiohttp.BasicAuth(*auth) if auth else None,
+                cookie_jar=aiohttp.DummyCookieJar())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self._session is not None:
+            if self._transport == "httpx-h2":
+                await self._session.aclose()
+            else:
+                await self._session.close()
+            self._session = None
+
+    def _retry_delay(self, e, attempt, method):
+        '''Seconds to wait before retrying method after error e, or None to
+        give up. POST is only retried if the request never reached EZID.
+        '''
+        if attempt >= RETRIES:
+            return None
+        status = headers = None
+        if self._transport == "httpx-h2":
+            import httpx
+            unsent = (httpx.ConnectError, httpx.ConnectTimeout)
+            maybe_sent = (httpx.TimeoutException, httpx.ReadError)
+            if isinstance(e, httpx.HTTPStatusError):
+                status, headers = e.response.status_code, e.response.headers
+            elif not isinstance(e, unsent if method == "POST" else unsent + maybe_sent):
+                return None
+        else:
+            import aiohttp
+            unsent = (aiohttp.ClientConnectorError,)
+            maybe_sent = (aiohttp.ClientOSError, aiohttp.ServerDisconnectedError,
+                          asyncio.TimeoutError)
+            if isinstance(e, aiohttp.ClientResponseError):
+                status, headers = e.status, e.headers
+            elif (isinstance(e, (aiohttp.ClientSSLError,
+                                 aiohttp.ClientConnectorCertificateError)) or
+                  not isinstance(e, unsent if method == "POST" else unsent + maybe_sent)):
+                return None
+        if status is not None:
+            if status not in (POST_RETRY_STATUS if method == "POST" else RETRY_STATUS):
+                return None
+            retry_after = headers.get("Retry-After", "") if headers else ""
+            if retry_after.isdigit():
+                return min(int(retry_after), RETRY_BACKOFF_MAX)
+        return min(RETRY_BACKOFF * 2 ** attempt + random.random() * 0.1,
+                   RETRY_BACKOFF_MAX)
+
+    async def _do(self, method, path, data=None, login=False):
+        attempt = 0
+        while True:
+            try:
+                return await self._send(method, path, data, login)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, method)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _send(self, method, path, data=None, login=False):
+        headers = {}
+        if data is not None:
+            headers["Content-Type"] = "text/plain; charset=UTF-8"
+        if self._session_id:
+            headers["Cookie"] = "sessionid=" + self._session_id
+        if self._transport == "httpx-h2":
+            r = await self._session.request(method, path, content=data,
+                                            headers=headers)
+            r.raise_for_status()
+            if login:
+                return r.cookies['sessionid']
+            return r.text
+        proxy = self._proxy.get('https') if self._proxy else None
+        async with self._session.request(method, self._server + path, data=data,
+                                         headers=headers, proxy=proxy) as r:
+            r.raise_for_status()
+            if login:
+                return r.cookies['sessionid'].value
+            return await r.text()
+
+    async def view(self, identifier):
+        return await self._do("GET", "/id/" + _quote_id(identifier))
+
+    async def login(self):
+        self._session_id = await self._do("GET", "/login", login=True)
+        return self._session_id
+
+    async def logout(self):
+        '''logout, dropping the session id
+        '''
+        output = await self._do("GET", "/logout")
+        self._session_id = None
+        return output
+
+    async def update(self, identifier, data):
+        return await self._do("POST", "/id/" + _quote_id(identifier),
+                              formatAnvlFromDictBytes(data))
+
+    async def create(self, identifier, data=None):
+        body = formatAnvlFromDictBytes(data) if data else None
+        return await self._do("PUT", "/id/" + _quote_id(identifier), body)
+
+    async def mint(self, shoulder, data=None):
+        '''Mint a new identifier on EZID. Return the identifier if successful
+        '''
+        body = formatAnvlFromDictBytes(data) if data else None
+        return (await self._do("POST", "/shoulder/" + _quote_id(shoulder), body)
+                ).replace('success: ','').strip()
+
+    async def mint_many(self, shoulder, records, concurrency=32):
+        '''Mint one identifier per entry of records, at most concurrency
+        at a time. Failed mints are returned in place as exceptions.
+        '''
+        sem = asyncio.Semaphore(concurrency)
+        async def _mint(data):
+            async with sem:
+                return await self.mint(shoulder, data)
+        return await asyncio.gather(*[_mint(r) for r in records],
+                                    return_exceptions=True)
+
+    async def delete(self, identifier):
+        return await self._do("DELETE", "/id/" + _quote_id(identifier))
 
 #+++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
 # Begin command line code
@@ -249,48 +692,41 @@ def process_args(args):
         u, p = args[1].split(':', 1)
         credentials = dict(username=u, password=p)
     elif args[1] != "-":
-        sessionid=args[1]
-    operation = [o for o in operations if o.startswith(args[2])]
-    if len(operation) != 1: _usageError()
-    operation = operation[0]
-    if (type(operations[operation]) is int and\
-        len(args)-3 != operations[operation]) or\
-        (type(operations[operation]) is types.LambdaType and\
-        not operations[operation](len(args)-3)): _usageError()
+        session_id = args[1]
+    operation = _PREFIX_MAP.get(args[2])
+    if operation is None: _usageError()
+    if not operations[operation](len(args)-3): _usageError()
     identifier = args[3] if len(args) > 3 else None
     if operation in ["mint", "create", "update",] :
         if len(args) > 4:
-            l = args[4:]
-            data = {}
-            for i in range(0, len(l), 2):
-                data[l[i]] = l[i+1]
+            it = iter(args[4:])
+            data = dict(zip(it, it))
     return credentials, session_id, operation, identifier, data
 
+_DISPATCH = {
+    # operation : call on (client, identifier, data)
+    "login" : lambda ez, i, d: ez.login(),
+    "logout" : lambda ez, i, d: ez.logout(),
+    "view" : lambda ez, i, d: ez.view(i),
+    "create" : lambda ez, i, d: ez.create(i, d),
+    "update" : lambda ez, i, d: ez.update(i, d) if d else None,
+    "delete" : lambda ez, i, d: ez.delete(i),
+    "mint" : lambda ez, i, d: ez.mint(i, d),
+}
+
 def main(argvin=sys.argv):
     '''Mimics client sample from api docs
     '''
     #opener, request, operation = processargs(argvin)
     credentials, session_id, operation, identifier, data = process_args(argvin)
-    ezid = EZIDClient(SERVER, credentials=credentials, session_id=session_id)
+    ezid = EZIDClient(SERVER, credentials=credentials, session_id=session_id,
+                      session_cache=True)
     try:
-        if operation == 'login':
-            print(ezid.login())
-        elif operation == 'view':
-            print(ezid.view(identifier))
-        elif operation == 'update':
-            if data:
-                print(ezid.update(identifier, data))
-        elif operation == 'delete':
-            print(ezid.delete(identifier))
-        elif operation == 'create':
-            print(ezid.create(identifier, data))
-        elif operation == 'mint':
-            print('MINTING\n')
-            print(ezid.mint(identifier, data))
-    except urllib.error.HTTPError as e:
-        print(e.code, e.msg)
-        if e.fp:
-            print(e.fp.read())
+        result = _DISPATCH[operation](ezid, identifier, data)
+        if result is not None:
+            print(result)
+    except requests.exceptions.HTTPError as e:
+        print(e.response.status_code, e.response.reason)
 
 if __name__=='__main__':
     main(sys.argv)
@@ -10,10 +10,15 @@ setup(name='EZID',
       url="https://github.com/ucldc/ezid",
       py_modules = ['EZID', 'DSC_EZID_minter'],
       scripts=['DSC_EZID_minter.py',],
+      python_requires='>=3.8',
       install_requires=[
-          'future',
           'requests',
+          'urllib3>=1.26',
       ],
+      extras_require={
+          'async': ['aiohttp'],
+          'http2': ['httpx[http2]>=0.26'],
+      },
       classifiers = [
           "Development Status :: 5 - Production/Stable",
           "Environment :: Console",